@@ -1,20 +1,58 @@
-import argparse
+from __future__ import annotations
+
+import bisect
+import functools
 import json
+import os
+import stat
 import sys
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from importlib.metadata import version
-
-import tiktoken
-from rich.console import Console
-from rich.table import Table
-from rich.text import Text
+from typing import TYPE_CHECKING
 
 from counts import REFERENCE_TEXTS
 
+if TYPE_CHECKING:
+    import tiktoken
+    from rich.console import Console
+
 __version__ = version("tokencount")
 DEFAULT_ENCODING = "o200k_base"
 
-stderr = Console(stderr=True)
+# Files above this size are tokenized in newline-aligned chunks instead of
+# being read into memory whole
+LARGE_FILE_BYTES = 32_000_000
+CHUNK_BYTES = 4 * 1024 * 1024
+CHUNK_BATCH = 16
+
+# Big multi-file runs fan out across processes; below these thresholds the
+# pool startup tax outweighs the win
+POOL_MIN_FILES = 4
+POOL_MIN_TOTAL_BYTES = 16_000_000
+
+HELP = f"""\
+usage: tc [-h] [-v] [-e ENCODING] [--json] [files ...]
+
+Count tokens in files or stdin using tiktoken
+
+positional arguments:
+  files                 Files to count tokens in. If none provided, reads
+                        from stdin.
+
+options:
+  -h, --help            show this help message and exit
+  -v, --version         show program's version number and exit
+  -e, --encoding ENCODING
+                        Tiktoken encoding to use (default: {DEFAULT_ENCODING})
+  --json                Output as JSON
+"""
+
+# REFERENCE_TEXTS is sorted by token count (ascending); keep a bare count
+# list so lookups can binary-search instead of scanning
+_REF_COUNTS = [count for _, _, count in REFERENCE_TEXTS]
+assert _REF_COUNTS == sorted(_REF_COUNTS)
 
 
 def get_reference_comparison(tokens: int) -> list[str]:
@@ -22,7 +60,6 @@ def get_reference_comparison(tokens: int) -> list[str]:
     if tokens <= 0 or not REFERENCE_TEXTS:
         return []
 
-    # REFERENCE_TEXTS is sorted by token count (ascending)
     smallest_title, smallest_author, smallest_count = REFERENCE_TEXTS[0]
     largest_title, largest_author, largest_count = REFERENCE_TEXTS[-1]
 
@@ -35,45 +72,181 @@ def get_reference_comparison(tokens: int) -> list[str]:
         pct = (tokens / largest_count) * 100
         return [f'Bigger than "{largest_title}" by {largest_author} ({pct:.0f}%)']
 
-    # Find lower and upper bounds
-    lower = None
-    upper = None
-    for title, author, count in REFERENCE_TEXTS:
-        if count <= tokens:
-            lower = (title, author, count)
-        elif upper is None:
-            upper = (title, author, count)
-            break
-
-    if lower and upper:
-        lower_title, lower_author, lower_count = lower
-        upper_title, upper_author, upper_count = upper
-        lower_pct = (tokens / lower_count) * 100
-        upper_pct = (tokens / upper_count) * 100
-        return [
-            f'Somewhere between "{lower_title}" and "{upper_title}"',
-            f'{lower_pct:.0f}% of "{lower_title}" ({lower_author}), {upper_pct:.0f}% of "{upper_title}" ({upper_author})',
-        ]
-
-    return []
+    # Binary-search for the neighbors instead of scanning the whole list
+    i = bisect.bisect_right(_REF_COUNTS, tokens)
+    if i >= len(REFERENCE_TEXTS):
+        return []
 
+    lower_title, lower_author, lower_count = REFERENCE_TEXTS[i - 1]
+    upper_title, upper_author, upper_count = REFERENCE_TEXTS[i]
+    lower_pct = (tokens / lower_count) * 100
+    upper_pct = (tokens / upper_count) * 100
+    return [
+        f'Somewhere between "{lower_title}" and "{upper_title}"',
+        f'{lower_pct:.0f}% of "{lower_title}" ({lower_author}), {upper_pct:.0f}% of "{upper_title}" ({upper_author})',
+    ]
 
-def count_tokens(text: str, encoding: str) -> int:
-    enc = tiktoken.get_encoding(encoding)
-    return len(enc.encode(text, disallowed_special=()))
 
+@functools.lru_cache(maxsize=1)
+def stderr() -> Console:
+    # rich costs tens of ms to import; only pay for it when printing
+    from rich.console import Console
+
+    return Console(stderr=True)
 
-def count_lines(text: str) -> int:
+
+@functools.lru_cache(maxsize=4)
+def get_encoding(encoding: str) -> tiktoken.Encoding:
+    """Load a tiktoken encoding once and reuse it across calls."""
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding)
+
+
+def count_tokens(text: str, encoding: str) -> int:
+    enc = get_encoding(encoding)
+    return len(enc.encode_ordinary(text))
+
+
+def scan_large_file(filepath: str, enc: tiktoken.Encoding) -> tuple[int, int, int]:
+    """Compute (tokens, lines, chars) for a file too big to hold in RAM.
+
+    Chunks are cut only after a newline followed by non-whitespace, so a
+    whitespace run never straddles a cut. The BPE pre-tokenizer treats a
+    whole run as one pre-token, so this keeps every pre-token inside one
+    chunk and the per-chunk counts sum exactly to the whole-file count.
+    """
+    tokens = 0
+    lines = 0
+    chars = 0
+    pending: list[str] = []
+
+    def flush() -> int:
+        n = sum(len(ids) for ids in enc.encode_ordinary_batch(pending))
+        pending.clear()
+        return n
+
+    with open(filepath, "rb") as f:
+        carry = b""
+        while raw := f.read(CHUNK_BYTES):
+            raw = carry + raw
+            # Cut after the last newline that is followed by
+            # non-whitespace. A newline followed by more whitespace may
+            # sit inside a single \s*[\r\n]+ pre-token that continues
+            # past it (possibly into the next read), and splitting a
+            # pre-token changes the count.
+            cut = 0
+            pos = raw.rfind(b"\n")
+            while pos != -1:
+                if pos + 1 < len(raw) and raw[pos + 1] not in b"\t\n\x0b\x0c\r ":
+                    cut = pos + 1
+                    break
+                pos = raw.rfind(b"\n", 0, pos)
+            if cut == 0:
+                carry = raw
+                continue
+            carry = raw[cut:]
+            lines += raw.count(b"\n", 0, cut)
+            chunk = raw[:cut].decode("utf-8")
+            chars += len(chunk)
+            pending.append(chunk)
+            if len(pending) >= CHUNK_BATCH:
+                tokens += flush()
+
+    if carry:
+        tail = carry.decode("utf-8")
+        lines += count_lines(carry)
+        chars += len(tail)
+        pending.append(tail)
+    if pending:
+        tokens += flush()
+    return tokens, lines, chars
+
+
+def count_lines(text: str | bytes) -> int:
     if not text:
         return 0
-    return text.count("\n") + (1 if not text.endswith("\n") else 0)
+    if isinstance(text, str):
+        return text.count("\n") + (1 if not text.endswith("\n") else 0)
+    return text.count(b"\n") + (1 if not text.endswith(b"\n") else 0)
 
 
-def count_chars(text: str) -> int:
-    return len(text)
+_worker_enc: tiktoken.Encoding | None = None
+
+
+def _init_worker(encoding: str) -> None:
+    """Pool initializer: load the encoding once per worker process."""
+    global _worker_enc
+    _worker_enc = get_encoding(encoding)
+
+
+def _count_one(filepath: str) -> tuple[str, int, int, int]:
+    """Read and tokenize one file inside a pool worker.
+
+    Returns (name, tokens, lines, chars); tokens is -1 for binary files.
+    """
+    assert _worker_enc is not None
+    if os.path.getsize(filepath) > LARGE_FILE_BYTES:
+        try:
+            tokens, lines, chars = scan_large_file(filepath, _worker_enc)
+        except UnicodeDecodeError:
+            return filepath, -1, 0, 0
+        return filepath, tokens, lines, chars
+    with open(filepath, "rb") as f:
+        raw = f.read()
+    try:
+        content = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return filepath, -1, 0, 0
+    return (
+        filepath,
+        len(_worker_enc.encode_ordinary(content)),
+        count_lines(raw),
+        len(content),
+    )
 
 
 @dataclass
+class Args:
+    files: list[str]
+    encoding: str = DEFAULT_ENCODING
+    json: bool = False
+
+
+def parse_args(argv: list[str]) -> Args:
+    """Minimal hand-rolled parser; argparse costs ~10 ms per cold start."""
+    args = Args(files=[])
+    it = iter(argv)
+    for arg in it:
+        if arg in ("-h", "--help"):
+            print(HELP, end="")
+            sys.exit(0)
+        elif arg in ("-v", "--version"):
+            print(f"tc {__version__}")
+            sys.exit(0)
+        elif arg in ("-e", "--encoding"):
+            value = next(it, None)
+            if value is None:
+                print(f"tc: option {arg} requires an argument", file=sys.stderr)
+                sys.exit(2)
+            args.encoding = value
+        elif arg.startswith("--encoding="):
+            args.encoding = arg.split("=", 1)[1]
+        elif arg.startswith("-e") and not arg.startswith("--"):
+            args.encoding = arg[2:]
+        elif arg == "--json":
+            args.json = True
+        elif arg == "--":
+            args.files.extend(it)
+        elif arg.startswith("-") and arg != "-":
+            print(f"tc: unknown option: {arg}", file=sys.stderr)
+            sys.exit(2)
+        else:
+            args.files.append(arg)
+    return args
+
+
+@dataclass(slots=True, frozen=True)
 class FileStats:
     name: str
     tokens: int
@@ -95,51 +268,55 @@ def print_pretty_output(
     total_lines = sum(s.lines for s in sorted_stats)
     total_chars = sum(s.chars for s in sorted_stats)
 
-    stderr.print()
+    # Assemble the whole report and emit it with one print, so rich
+    # renders once instead of per line
+    parts: list[str] = [""]
 
     if len(sorted_stats) > 1:
-        table = Table(show_header=False, box=None, padding=(0, 1))
-        table.add_column(justify="right", style="cyan")
-        table.add_column(style="dim")
-
-        for s in sorted_stats:
-            table.add_row(f"{s.tokens:,}", s.name)
-
-        stderr.print(table)
-        stderr.print()
-
-    stderr.print(f"  [dim]{total_lines:,} lines, {format_size(total_chars)}[/dim]")
-    stderr.print()
-
-    token_text = Text()
-    token_text.append("  ")
-    token_text.append(f"{total_tokens:,}", style="bold green")
-    token_text.append(" tokens ", style="green")
-    token_text.append(f"({encoding})", style="dim")
-    stderr.print(token_text)
+        # Pre-format the rows ourselves: no Table layout pass, no per-row
+        # regex highlighting. The width goes into the template once
+        # instead of being re-interpolated per row.
+        width = len(f"{sorted_stats[-1].tokens:,}")
+        row = f" [cyan]{{:>{width},}}[/cyan] [dim]{{}}[/dim]".format
+        parts.extend(row(s.tokens, s.name) for s in sorted_stats)
+        parts.append("")
+
+    parts.append(f"  [dim]{total_lines:,} lines, {format_size(total_chars)}[/dim]")
+    parts.append("")
+    parts.append(
+        f"  [bold green]{total_tokens:,}[/bold green]"
+        f"[green] tokens [/green][dim]({encoding})[/dim]"
+    )
 
     # Show reference comparison only for default encoding
     if encoding == DEFAULT_ENCODING:
-        for line in get_reference_comparison(total_tokens):
-            stderr.print(f"  [dim italic]{line}[/dim italic]")
+        parts.extend(
+            f"  [dim italic]{line}[/dim italic]"
+            for line in get_reference_comparison(total_tokens)
+        )
 
     if total_tokens > 1_000_000:
-        stderr.print()
-        stderr.print(
+        parts.append("")
+        parts.append(
             "  [bold red]Exceeds 1M token context limit of most models.[/bold red]"
         )
 
-    stderr.print()
+    parts.append("")
+    stderr().print("\n".join(parts), highlight=False)
     print(total_tokens)
 
 
 def print_json_output(
-    sorted_stats: list[FileStats], total_tokens: int, encoding: str
+    sorted_stats: list[FileStats],
+    total_tokens: int,
+    encoding: str,
+    is_sorted: bool,
 ) -> None:
     total_lines = sum(s.lines for s in sorted_stats)
     total_chars = sum(s.chars for s in sorted_stats)
     output = {
         "encoding": encoding,
+        "sorted": is_sorted,
         "files": [
             {
                 "name": s.name,
@@ -155,84 +332,175 @@ def print_json_output(
             "tokens": total_tokens,
         },
     }
-    print(json.dumps(output, indent=2))
+    try:
+        # Optional speedup, deliberately undeclared: installs that have
+        # orjson use it, everyone else falls through to stdlib json
+        import orjson  # pyright: ignore[reportMissingImports]
 
+        sys.stdout.buffer.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
+        sys.stdout.buffer.write(b"\n")
+        sys.stdout.buffer.flush()
+    except ImportError:
+        print(json.dumps(output, indent=2))
 
-def main() -> None:
-    parser = argparse.ArgumentParser(
-        description="Count tokens in files or stdin using tiktoken"
-    )
-    parser.add_argument(
-        "-v",
-        "--version",
-        action="version",
-        version=f"tc {__version__}",
-    )
-    parser.add_argument(
-        "files",
-        nargs="*",
-        help="Files to count tokens in. If none provided, reads from stdin.",
-    )
-    parser.add_argument(
-        "-e",
-        "--encoding",
-        default=DEFAULT_ENCODING,
-        help=f"Tiktoken encoding to use (default: {DEFAULT_ENCODING})",
-    )
-    parser.add_argument(
-        "--json",
-        action="store_true",
-        help="Output as JSON",
-    )
-    args = parser.parse_args()
 
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    # Validation doubles as the real load: get_encoding is cached, so
+    # every later use of this encoding is a dict hit
     try:
-        tiktoken.get_encoding(args.encoding)
+        enc = get_encoding(args.encoding)
     except ValueError:
-        stderr.print(f"[red]tc: unknown encoding: {args.encoding}[/red]")
+        stderr().print(f"[red]tc: unknown encoding: {args.encoding}[/red]")
         sys.exit(1)
 
     file_stats: list[FileStats] = []
 
     if args.files:
-        for filepath in args.files:
+        names: list[str] = []
+        contents: list[str] = []
+
+        def read_file(filepath: str) -> bytes:
+            # One sized read instead of BufferedReader's incremental chunks
+            fd = os.open(filepath, os.O_RDONLY)
+            try:
+                st = os.fstat(fd)
+                if st.st_size == 0 or not stat.S_ISREG(st.st_mode):
+                    # FIFOs and /proc files report st_size 0; read until
+                    # EOF so `tc <(git diff)` still works
+                    parts = []
+                    while part := os.read(fd, CHUNK_BYTES):
+                        parts.append(part)
+                    return b"".join(parts)
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, st.st_size, os.POSIX_FADV_SEQUENTIAL)
+                return os.read(fd, st.st_size)
+            finally:
+                os.close(fd)
+
+        def size_of(filepath: str) -> int:
             try:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    content = f.read()
-                stats = FileStats(
-                    name=filepath,
-                    tokens=count_tokens(content, args.encoding),
-                    lines=count_lines(content),
-                    chars=count_chars(content),
+                return os.path.getsize(filepath)
+            except OSError:
+                return 0
+
+        sizes = [size_of(filepath) for filepath in args.files]
+
+        if len(args.files) >= POOL_MIN_FILES and sum(sizes) > POOL_MIN_TOTAL_BYTES:
+            # Heavy runs: fan whole files out across worker processes so
+            # Python-side orchestration isn't the serial bottleneck
+            import multiprocessing
+
+            with multiprocessing.Pool(
+                processes=os.cpu_count(),
+                initializer=_init_worker,
+                initargs=(args.encoding,),
+            ) as procs:
+                try:
+                    for name, tokens, lines, chars in procs.imap_unordered(
+                        _count_one, args.files, chunksize=4
+                    ):
+                        if tokens < 0:
+                            stderr().print(
+                                f"[yellow]tc: {name}: skipping binary file[/yellow]"
+                            )
+                            continue
+                        file_stats.append(FileStats(name, tokens, lines, chars))
+                except FileNotFoundError as e:
+                    stderr().print(
+                        f"[red]tc: {e.filename}: No such file or directory[/red]"
+                    )
+                    sys.exit(1)
+                except IsADirectoryError as e:
+                    stderr().print(f"[red]tc: {e.filename}: Is a directory[/red]")
+                    sys.exit(1)
+        else:
+            # Overlap reads across files; the encode batch below is
+            # CPU-bound in Rust with the GIL released, so I/O is the
+            # serial part to hide. Oversized files stream through
+            # scan_large_file instead of being read whole.
+            with ThreadPoolExecutor(max_workers=min(8, len(args.files))) as pool:
+                futures = [
+                    (
+                        pool.submit(scan_large_file, filepath, enc)
+                        if size > LARGE_FILE_BYTES
+                        else pool.submit(read_file, filepath)
+                    )
+                    for filepath, size in zip(args.files, sizes)
+                ]
+
+            line_counts: list[int] = []
+            for filepath, future in zip(args.files, futures):
+                try:
+                    result = future.result()
+                    if isinstance(result, tuple):
+                        tokens, lines, chars = result
+                        file_stats.append(FileStats(filepath, tokens, lines, chars))
+                        continue
+                    raw = result
+                    contents.append(raw.decode("utf-8"))
+                    names.append(filepath)
+                    # Count newlines on the raw bytes: one memchr-style
+                    # scan, no second pass over the decoded str
+                    line_counts.append(count_lines(raw))
+                except FileNotFoundError:
+                    stderr().print(
+                        f"[red]tc: {filepath}: No such file or directory[/red]"
+                    )
+                    sys.exit(1)
+                except IsADirectoryError:
+                    stderr().print(f"[red]tc: {filepath}: Is a directory[/red]")
+                    sys.exit(1)
+                except UnicodeDecodeError:
+                    stderr().print(
+                        f"[yellow]tc: {filepath}: skipping binary file[/yellow]"
+                    )
+                    continue
+
+            # Batch-encode so tiktoken fans the BPE work across cores.
+            # The per-file stats live in parallel lists until this point;
+            # only here do they become FileStats rows for sorting and
+            # output.
+            token_lists = enc.encode_ordinary_batch(
+                contents, num_threads=os.cpu_count() or 1
+            )
+            token_counts = map(len, token_lists)
+            char_counts = map(len, contents)
+            file_stats.extend(
+                FileStats(name, tokens, lines, chars)
+                for name, tokens, lines, chars in zip(
+                    names, token_counts, line_counts, char_counts
                 )
-                file_stats.append(stats)
-            except FileNotFoundError:
-                stderr.print(f"[red]tc: {filepath}: No such file or directory[/red]")
-                sys.exit(1)
-            except IsADirectoryError:
-                stderr.print(f"[red]tc: {filepath}: Is a directory[/red]")
-                sys.exit(1)
-            except UnicodeDecodeError:
-                stderr.print(f"[yellow]tc: {filepath}: skipping binary file[/yellow]")
-                continue
+            )
     else:
         if sys.stdin.isatty():
-            parser.print_help()
+            print(HELP, end="")
             sys.exit(0)
         content = sys.stdin.read()
+        # Single pass: one newline scan plus the encode, chars is O(1)
+        nl = content.count("\n")
         stats = FileStats(
             name="stdin",
             tokens=count_tokens(content, args.encoding),
-            lines=count_lines(content),
-            chars=count_chars(content),
+            lines=nl + (1 if content and not content.endswith("\n") else 0),
+            chars=len(content),
         )
         file_stats.append(stats)
 
-    sorted_stats = sorted(file_stats, key=lambda x: x.tokens)
+    if args.json and len(file_stats) > 10_000:
+        # Don't pay O(N log N) for huge runs; the pool path collects in
+        # completion order, so the files array is in no particular order
+        # and the payload says so via "sorted": false
+        sorted_stats = file_stats
+        is_sorted = False
+    else:
+        sorted_stats = sorted(file_stats, key=attrgetter("tokens"))
+        is_sorted = True
     total_tokens = sum(s.tokens for s in sorted_stats)
 
     if args.json:
-        print_json_output(sorted_stats, total_tokens, args.encoding)
+        print_json_output(sorted_stats, total_tokens, args.encoding, is_sorted)
     else:
         print_pretty_output(sorted_stats, total_tokens, args.encoding)
 
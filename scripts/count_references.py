@@ -9,68 +9,213 @@ Usage:
 """
 
 import argparse
+import functools
+import gzip
+import hashlib
+import http.client
+import json
+import mmap
+import os
+import re
 import sys
-import urllib.request
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import itemgetter
 from pathlib import Path
 
 import tiktoken
 
 ENCODING = "o200k_base"
 
-# (title, author, gutenberg_id)
-# None for gutenberg_id means local file in extra/
+# Downloads and token counts are pure functions of (book_id, ENCODING);
+# keep them on disk so warm runs skip the network and the BPE work
+CACHE_DIR = Path(__file__).parent / ".cache"
+COUNT_CACHE_PATH = CACHE_DIR / "token_counts.json"
+SIZES_CACHE_PATH = CACHE_DIR / "sizes.json"
+
+# (title, author, gutenberg_id, local_path)
+# None for gutenberg_id means local file at local_path instead
 SOURCES = [
-    ("Hop on Pop", "Dr. Seuss", None),  # extra/hw2/hoponpop.txt
-    ("Green Eggs and Ham", "Dr. Seuss", None),  # extra/hw2/greeneggsandham.txt
-    ("Fox in Socks", "Dr. Seuss", None),  # extra/hw2/foxinsocks.txt
-    ("One Fish Two Fish", "Dr. Seuss", None),  # extra/hw2/onefishtwofish.txt
-    ("The Cat in the Hat", "Dr. Seuss", None),  # extra/hw2/catinthehat.txt
-    ("The Waste Land", "T.S. Eliot", None),  # extra/texts/wasteland.txt
-    ("A Modest Proposal", "Jonathan Swift", 1080),
-    ("The Yellow Wallpaper", "C.P. Gilman", 1952),
-    ("Alice in Wonderland", "Lewis Carroll", 11),
-    ("Heart of Darkness", "Joseph Conrad", 219),
-    ("A Study in Scarlet", "Arthur Conan Doyle", 244),
-    ("Peter Pan", "J.M. Barrie", 16),
-    ("The Prince", "Machiavelli", 1232),
-    ("Treasure Island", "R.L. Stevenson", 120),
-    ("Frankenstein", "Mary Shelley", 84),
-    ("Tom Sawyer", "Mark Twain", 74),
-    ("Dorian Gray", "Oscar Wilde", 174),
-    ("Sherlock Holmes", "Arthur Conan Doyle", 1661),
-    ("Wuthering Heights", "Emily Brontë", 768),
-    ("Pride and Prejudice", "Jane Austen", 1342),
-    ("A Tale of Two Cities", "Charles Dickens", 98),
-    ("Dracula", "Bram Stoker", 345),
-    ("Great Expectations", "Charles Dickens", 1400),
-    ("Jane Eyre", "Charlotte Brontë", 1260),
-    ("Crime and Punishment", "Fyodor Dostoevsky", 2554),
-    ("Moby Dick", "Herman Melville", 2701),
-    ("War and Peace", "Leo Tolstoy", 2600),
+    ("Hop on Pop", "Dr. Seuss", None, "extra/hw2/hoponpop.txt"),
+    ("Green Eggs and Ham", "Dr. Seuss", None, "extra/hw2/greeneggsandham.txt"),
+    ("Fox in Socks", "Dr. Seuss", None, "extra/hw2/foxinsocks.txt"),
+    ("One Fish Two Fish", "Dr. Seuss", None, "extra/hw2/onefishtwofish.txt"),
+    ("The Cat in the Hat", "Dr. Seuss", None, "extra/hw2/catinthehat.txt"),
+    ("The Waste Land", "T.S. Eliot", None, "extra/texts/wasteland.txt"),
+    ("A Modest Proposal", "Jonathan Swift", 1080, None),
+    ("The Yellow Wallpaper", "C.P. Gilman", 1952, None),
+    ("Alice in Wonderland", "Lewis Carroll", 11, None),
+    ("Heart of Darkness", "Joseph Conrad", 219, None),
+    ("A Study in Scarlet", "Arthur Conan Doyle", 244, None),
+    ("Peter Pan", "J.M. Barrie", 16, None),
+    ("The Prince", "Machiavelli", 1232, None),
+    ("Treasure Island", "R.L. Stevenson", 120, None),
+    ("Frankenstein", "Mary Shelley", 84, None),
+    ("Tom Sawyer", "Mark Twain", 74, None),
+    ("Dorian Gray", "Oscar Wilde", 174, None),
+    ("Sherlock Holmes", "Arthur Conan Doyle", 1661, None),
+    ("Wuthering Heights", "Emily Brontë", 768, None),
+    ("Pride and Prejudice", "Jane Austen", 1342, None),
+    ("A Tale of Two Cities", "Charles Dickens", 98, None),
+    ("Dracula", "Bram Stoker", 345, None),
+    ("Great Expectations", "Charles Dickens", 1400, None),
+    ("Jane Eyre", "Charlotte Brontë", 1260, None),
+    ("Crime and Punishment", "Fyodor Dostoevsky", 2554, None),
+    ("Moby Dick", "Herman Melville", 2701, None),
+    ("War and Peace", "Leo Tolstoy", 2600, None),
 ]
 
-# Local file mappings for non-Gutenberg sources
-LOCAL_FILES = {
-    "Hop on Pop": "extra/hw2/hoponpop.txt",
-    "Green Eggs and Ham": "extra/hw2/greeneggsandham.txt",
-    "Fox in Socks": "extra/hw2/foxinsocks.txt",
-    "One Fish Two Fish": "extra/hw2/onefishtwofish.txt",
-    "The Cat in the Hat": "extra/hw2/catinthehat.txt",
-    "The Waste Land": "extra/texts/wasteland.txt",
-}
+
+GUTENBERG_HOST = "www.gutenberg.org"
+
+# One keep-alive connection per download thread: all books come from the
+# same host, so every extra TCP+TLS handshake is wasted round trips
+_conn_local = threading.local()
+
+# Download threads log through one lock with one write each, so progress
+# lines don't interleave mid-line
+_stderr_lock = threading.Lock()
+
+
+def _log(msg: str) -> None:
+    with _stderr_lock:
+        sys.stderr.write(msg)
+
+
+def _gutenberg_request(path: str) -> bytes:
+    conn = getattr(_conn_local, "conn", None)
+    for attempt in (1, 2):
+        if conn is None:
+            conn = http.client.HTTPSConnection(GUTENBERG_HOST, timeout=30)
+            _conn_local.conn = conn
+        try:
+            # gzip cuts the plain-text bodies roughly 3x on the wire
+            conn.request(
+                "GET",
+                path,
+                headers={
+                    "Accept-Encoding": "gzip",
+                    "User-Agent": "tokencount/1.0",
+                },
+            )
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+        except (http.client.HTTPException, OSError):
+            # Server dropped the keep-alive connection; rebuild once
+            conn.close()
+            conn = _conn_local.conn = None
+            if attempt == 2:
+                raise
+            continue
+        if resp.status != 200:
+            raise RuntimeError(f"HTTP {resp.status} for https://{GUTENBERG_HOST}{path}")
+        return body
+    raise AssertionError("unreachable")
+
+
+def fetch_gutenberg(book_id: int) -> bytes:
+    """Fetch plain text (raw UTF-8) from Project Gutenberg, caching on disk."""
+    cache_path = CACHE_DIR / f"pg{book_id}.txt"
+    if cache_path.exists():
+        return cache_path.read_bytes()
+
+    path = f"/cache/epub/{book_id}/pg{book_id}.txt"
+    _log(f"  Fetching https://{GUTENBERG_HOST}{path}...\n")
+    body = _gutenberg_request(path)
+
+    CACHE_DIR.mkdir(exist_ok=True)
+    cache_path.write_bytes(body)
+    return body
+
+
+def read_local(path: Path) -> bytes:
+    """Read a local reference file through mmap.
+
+    The OS pages the file straight into the returned buffer with no
+    intermediate read-loop copies.
+    """
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:]
+
+
+def _count_cache_key(data: bytes) -> str:
+    return f"{hashlib.sha256(data).hexdigest()}:{ENCODING}"
+
+
+def _load_count_cache() -> dict[str, int]:
+    try:
+        return json.loads(COUNT_CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
 
 
-def fetch_gutenberg(book_id: int) -> str:
-    """Fetch plain text from Project Gutenberg."""
-    url = f"https://www.gutenberg.org/cache/epub/{book_id}/pg{book_id}.txt"
-    print(f"  Fetching {url}...", file=sys.stderr)
-    with urllib.request.urlopen(url, timeout=30) as resp:
-        return resp.read().decode("utf-8")
+def _save_count_cache(cache: dict[str, int]) -> None:
+    CACHE_DIR.mkdir(exist_ok=True)
+    COUNT_CACHE_PATH.write_text(json.dumps(cache, indent=2), encoding="utf-8")
 
 
-def count_tokens(text: str) -> int:
-    enc = tiktoken.get_encoding(ENCODING)
-    return len(enc.encode(text))
+def _load_sizes() -> dict[str, int]:
+    try:
+        return json.loads(SIZES_CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_sizes(sizes: dict[str, int]) -> None:
+    CACHE_DIR.mkdir(exist_ok=True)
+    SIZES_CACHE_PATH.write_text(json.dumps(sizes, indent=2), encoding="utf-8")
+
+
+@functools.cache
+def _get_encoder() -> tiktoken.Encoding:
+    return tiktoken.get_encoding(ENCODING)
+
+
+# Texts longer than this are tokenized as parallel chunks split at
+# paragraph boundaries
+CHUNK_CHARS = 200_000
+
+# A blank line in either LF or CRLF form; Gutenberg plain text is CRLF
+_BLANK_LINE = re.compile(r"\r?\n\r?\n")
+
+
+def _split_paragraph_chunks(text: str) -> list[str]:
+    """Split into ~CHUNK_CHARS pieces, cutting only after a newline run.
+
+    Each cut lands right after the last newline of a blank-line run,
+    with the next character non-whitespace, so no whitespace pre-token
+    is ever split and the per-chunk token counts sum exactly to the
+    whole-text count.
+    """
+    chunks: list[str] = []
+    start = 0
+    while start < len(text):
+        pos = start + CHUNK_CHARS
+        while match := _BLANK_LINE.search(text, pos):
+            end = match.end()
+            while end < len(text) and text[end] in "\r\n":
+                end += 1
+            # Indented text after the run would extend the whitespace
+            # pre-token past the cut; look for the next blank line
+            if end >= len(text) or not text[end].isspace():
+                break
+            pos = end
+        else:
+            chunks.append(text[start:])
+            break
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+_PARSER = argparse.ArgumentParser(description="Generate REFERENCE_TEXTS")
+_PARSER.add_argument("--stdout", action="store_true", help="Print to stdout")
+_PARSER.add_argument("--table", action="store_true", help="Output as table")
 
 
 def generate_python(results: list[tuple[str, str, int]]) -> str:
@@ -87,37 +232,122 @@ def generate_python(results: list[tuple[str, str, int]]) -> str:
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Generate REFERENCE_TEXTS")
-    parser.add_argument("--stdout", action="store_true", help="Print to stdout")
-    parser.add_argument("--table", action="store_true", help="Output as table")
-    args = parser.parse_args()
+    args = _PARSER.parse_args()
+
+    # Load the encoder before spawning download threads: a cold tiktoken
+    # cache means a vocab download, and it shouldn't queue behind the
+    # book fetches
+    _get_encoder()
 
     script_dir = Path(__file__).parent.parent
     results: list[tuple[str, str, int]] = []
 
-    for title, author, gutenberg_id in SOURCES:
-        print(f"Processing: {title}...", file=sys.stderr)
+    # Phase 1: load every source concurrently through one pool; remote
+    # fetches and local reads are all independent blocking I/O. Submit
+    # longest-known-first (LPT) so War and Peace isn't the straggler that
+    # sets total wall time; sources with no recorded size go first.
+    sizes = _load_sizes()
+    submit_order = sorted(
+        SOURCES,
+        key=lambda source: sizes.get(source[0], float("inf")),
+        reverse=True,
+    )
+    fetched: dict[int, bytes | Exception] = {}
+    local_texts: dict[str, bytes | Exception] = {}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures: dict = {}
+        for title, _, gutenberg_id, local_file in submit_order:
+            if gutenberg_id is None:
+                # SOURCES invariant: exactly one of gutenberg_id and
+                # local_path is set per entry
+                assert local_file is not None
+                futures[pool.submit(read_local, script_dir / local_file)] = (
+                    "local",
+                    title,
+                )
+            else:
+                futures[pool.submit(fetch_gutenberg, gutenberg_id)] = (
+                    "remote",
+                    gutenberg_id,
+                )
+        for future in as_completed(futures):
+            kind, key = futures[future]
+            try:
+                result: bytes | Exception = future.result()
+            except Exception as e:
+                result = e
+            if kind == "local":
+                local_texts[key] = result
+            else:
+                fetched[key] = result
+
+    # Phase 2: walk SOURCES in declaration order so logs and error
+    # handling read the same as before. Hashing happens on the raw UTF-8
+    # bytes; texts only get decoded (once) when their count isn't cached,
+    # so warm runs never decode at all.
+    count_cache = _load_count_cache()
+    loaded: list[tuple[str, str, str]] = []  # (title, author, cache key)
+    pending: dict[str, str] = {}  # cache key -> text, uncached only
+    for title, author, gutenberg_id, _ in SOURCES:
+        msg = f"Processing: {title}...\n"
         try:
             if gutenberg_id is None:
-                local_path = script_dir / LOCAL_FILES[title]
-                text = local_path.read_text(encoding="utf-8")
+                raw_or_error = local_texts.pop(title)
             else:
-                text = fetch_gutenberg(gutenberg_id)
+                raw_or_error = fetched.pop(gutenberg_id)
+            if isinstance(raw_or_error, Exception):
+                raise raw_or_error
+            raw = raw_or_error
 
-            tokens = count_tokens(text)
-            results.append((title, author, tokens))
-            print(f"  -> {tokens:,} tokens", file=sys.stderr)
+            key = _count_cache_key(raw)
+            sizes[title] = len(raw)
+            if key not in count_cache:
+                pending[key] = raw.decode("utf-8")
+            loaded.append((title, author, key))
+            del raw
         except Exception as e:
-            print(f"  ERROR: {e}", file=sys.stderr)
+            msg += f"  ERROR: {e}\n"
+        _log(msg)
+
+    _save_sizes(sizes)
+
+    # Phase 3: tokenize the unseen texts in one batch so tiktoken's Rust
+    # core runs the BPE work across all cores, keeping only the counts.
+    # Long texts are pre-split at paragraph boundaries so a single giant
+    # book still parallelizes instead of pinning one core.
+    if pending:
+        batch_keys = list(pending)
+        chunk_lists = [_split_paragraph_chunks(text) for text in pending.values()]
+        pending.clear()  # texts are no longer needed once the chunks exist
+        token_lists = _get_encoder().encode_ordinary_batch(
+            [chunk for chunks in chunk_lists for chunk in chunks],
+            num_threads=os.cpu_count() or 1,
+        )
+        counts = iter(token_lists)
+        for key, chunks in zip(batch_keys, chunk_lists):
+            count_cache[key] = sum(len(next(counts)) for _ in chunks)
+        _save_count_cache(count_cache)
+
+    count_lines: list[str] = []
+    for title, author, key in loaded:
+        tokens = count_cache[key]
+        results.append((title, author, tokens))
+        count_lines.append(f"  {title}: {tokens:,} tokens\n")
+    _log("".join(count_lines))
 
-    results.sort(key=lambda x: x[2])
+    results.sort(key=itemgetter(2))
     print(file=sys.stderr)
 
     if args.table:
-        for title, author, tokens in results:
-            print(f"{tokens:>12,}  {title} by {author}")
+        # One joined write instead of a syscall per row
+        sys.stdout.write(
+            "".join(
+                f"{tokens:>12,}  {title} by {author}\n"
+                for title, author, tokens in results
+            )
+        )
     elif args.stdout:
-        print(generate_python(results))
+        sys.stdout.write(generate_python(results) + "\n")
     else:
         counts_path = script_dir / "counts.py"
         counts_path.write_text(generate_python(results))
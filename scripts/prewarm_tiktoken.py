@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+Pre-warm the tiktoken encoding cache.
+
+Run with TIKTOKEN_CACHE_DIR set (e.g. in a Dockerfile or via
+`make prewarm`) so the first real tokenization reads the BPE vocab from
+disk instead of downloading it.
+"""
+
+import tiktoken
+
+ENCODING = "o200k_base"
+
+
+def main() -> None:
+    tiktoken.get_encoding(ENCODING)
+    print(f"Cached {ENCODING}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,32 @@
+import io
+import json
+import os
 import subprocess
-import tempfile
+import sys
+from collections.abc import Iterator
 from pathlib import Path
 
-from main import DEFAULT_ENCODING, count_tokens
+import pytest
+
+from main import DEFAULT_ENCODING, count_tokens, main
+
+
+@pytest.fixture(scope="module")
+def tiktoken_cache(tmp_path_factory) -> Iterator[Path]:
+    """Pre-warm a tiktoken cache dir so subprocesses skip the BPE download."""
+    cache_dir = tmp_path_factory.mktemp("tiktoken_cache")
+    old = os.environ.get("TIKTOKEN_CACHE_DIR")
+    os.environ["TIKTOKEN_CACHE_DIR"] = str(cache_dir)
+    try:
+        import tiktoken
+
+        tiktoken.get_encoding(DEFAULT_ENCODING)
+        yield cache_dir
+    finally:
+        if old is None:
+            os.environ.pop("TIKTOKEN_CACHE_DIR", None)
+        else:
+            os.environ["TIKTOKEN_CACHE_DIR"] = old
 
 
 def test_count_tokens_basic() -> None:
@@ -13,125 +37,104 @@ def test_count_tokens_empty() -> None:
     assert count_tokens("", DEFAULT_ENCODING) == 0
 
 
-def test_custom_encoding() -> None:
+def test_custom_encoding(capsys, monkeypatch) -> None:
+    monkeypatch.setattr(sys, "stdin", io.StringIO("hello world"))
+    main(["-e", "cl100k_base"])
+    captured = capsys.readouterr()
+    assert captured.out.strip().isdigit()
+
+
+def test_invalid_encoding(capsys, monkeypatch) -> None:
+    monkeypatch.setattr(sys, "stdin", io.StringIO("hello"))
+    with pytest.raises(SystemExit) as exc_info:
+        main(["-e", "invalid_encoding"])
+    assert exc_info.value.code == 1
+    assert "unknown encoding" in capsys.readouterr().err
+
+
+def test_single_file(tmp_path: Path, capsys) -> None:
+    p = tmp_path / "a.txt"
+    p.write_text("hello world")
+    main([str(p)])
+    captured = capsys.readouterr()
+    assert captured.out.strip().isdigit()
+    assert int(captured.out.strip()) > 0
+    assert "lines" in captured.err
+    assert "tokens" in captured.err
+
+
+def test_multiple_files_sorted_output(tmp_path: Path, capsys) -> None:
+    small = tmp_path / "small.txt"
+    large = tmp_path / "large.txt"
+    small.write_text("hi")
+    large.write_text("hello world this is a longer text with more tokens")
+
+    main([str(large), str(small)])
+    captured = capsys.readouterr()
+    assert captured.out.strip().isdigit()
+
+    assert "lines" in captured.err
+    assert "tokens" in captured.err
+    assert small.name in captured.err
+    assert large.name in captured.err
+    small_pos = captured.err.find(small.name)
+    large_pos = captured.err.find(large.name)
+    assert small_pos < large_pos
+
+
+def test_json_output(tmp_path: Path, capsys) -> None:
+    p = tmp_path / "a.txt"
+    p.write_text("hello world")
+    main(["--json", str(p)])
+    captured = capsys.readouterr()
+
+    data = json.loads(captured.out)
+    assert "encoding" in data
+    assert "files" in data
+    assert "total" in data
+    assert data["sorted"] is True
+    assert data["total"]["tokens"] > 0
+    assert data["total"]["lines"] > 0
+    assert data["total"]["chars"] > 0
+
+
+def test_stdin_input(capsys, monkeypatch) -> None:
+    monkeypatch.setattr(sys, "stdin", io.StringIO("hello world"))
+    main([])
+    captured = capsys.readouterr()
+    assert captured.out.strip().isdigit()
+    assert int(captured.out.strip()) > 0
+
+
+def test_file_not_found(capsys) -> None:
+    with pytest.raises(SystemExit) as exc_info:
+        main(["nonexistent_file.txt"])
+    assert exc_info.value.code == 1
+    assert "No such file or directory" in capsys.readouterr().err
+
+
+def test_directory_error(tmp_path: Path, capsys) -> None:
+    with pytest.raises(SystemExit) as exc_info:
+        main([str(tmp_path)])
+    assert exc_info.value.code == 1
+    assert "Is a directory" in capsys.readouterr().err
+
+
+def test_cli_smoke(tiktoken_cache: Path) -> None:
+    # One true end-to-end run through the installed entry point path.
+    # -I skips site.py and sys.path scanning, and the warmed cache dir
+    # means the subprocess reads the BPE blob from disk instead of the
+    # network.
     result = subprocess.run(
-        ["python", "main.py", "-e", "cl100k_base"],
+        [sys.executable, "-I", "main.py"],
         input="hello world",
         capture_output=True,
         text=True,
+        env={
+            **os.environ,
+            "PYTHONDONTWRITEBYTECODE": "1",
+            "TIKTOKEN_CACHE_DIR": str(tiktoken_cache),
+        },
     )
     assert result.returncode == 0
     assert result.stdout.strip().isdigit()
-
-
-def test_invalid_encoding() -> None:
-    result = subprocess.run(
-        ["python", "main.py", "-e", "invalid_encoding"],
-        input="hello",
-        capture_output=True,
-        text=True,
-    )
-    assert result.returncode == 1
-    assert "unknown encoding" in result.stderr
-
-
-def test_single_file() -> None:
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False) as f:
-        f.write("hello world")
-        f.flush()
-        result = subprocess.run(
-            ["python", "main.py", f.name],
-            capture_output=True,
-            text=True,
-        )
-        assert result.returncode == 0
-        assert result.stdout.strip().isdigit()
-        assert int(result.stdout.strip()) > 0
-        assert "lines" in result.stderr
-        assert "tokens" in result.stderr
-    Path(f.name).unlink()
-
-
-def test_multiple_files_sorted_output() -> None:
-    with (
-        tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False) as small,
-        tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False) as large,
-    ):
-        small.write("hi")
-        large.write("hello world this is a longer text with more tokens")
-        small.flush()
-        large.flush()
-
-        result = subprocess.run(
-            ["python", "main.py", large.name, small.name],
-            capture_output=True,
-            text=True,
-        )
-        assert result.returncode == 0
-        assert result.stdout.strip().isdigit()
-
-        assert "lines" in result.stderr
-        assert "tokens" in result.stderr
-        assert small.name in result.stderr
-        assert large.name in result.stderr
-        small_pos = result.stderr.find(small.name)
-        large_pos = result.stderr.find(large.name)
-        assert small_pos < large_pos
-
-    Path(small.name).unlink()
-    Path(large.name).unlink()
-
-
-def test_json_output() -> None:
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False) as f:
-        f.write("hello world")
-        f.flush()
-        result = subprocess.run(
-            ["python", "main.py", "--json", f.name],
-            capture_output=True,
-            text=True,
-        )
-        assert result.returncode == 0
-        import json
-
-        data = json.loads(result.stdout)
-        assert "encoding" in data
-        assert "files" in data
-        assert "total" in data
-        assert data["total"]["tokens"] > 0
-        assert data["total"]["lines"] > 0
-        assert data["total"]["chars"] > 0
-    Path(f.name).unlink()
-
-
-def test_stdin_input() -> None:
-    result = subprocess.run(
-        ["python", "main.py"],
-        input="hello world",
-        capture_output=True,
-        text=True,
-    )
-    assert result.returncode == 0
-    assert result.stdout.strip().isdigit()
-    assert int(result.stdout.strip()) > 0
-
-
-def test_file_not_found() -> None:
-    result = subprocess.run(
-        ["python", "main.py", "nonexistent_file.txt"],
-        capture_output=True,
-        text=True,
-    )
-    assert result.returncode == 1
-    assert "No such file or directory" in result.stderr
-
-
-def test_directory_error() -> None:
-    with tempfile.TemporaryDirectory() as tmpdir:
-        result = subprocess.run(
-            ["python", "main.py", tmpdir],
-            capture_output=True,
-            text=True,
-        )
-        assert result.returncode == 1
-        assert "Is a directory" in result.stderr